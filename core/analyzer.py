@@ -1,149 +1,327 @@
+import re
 import sqlglot
 from sqlglot import exp
-from typing import List, Dict, Any
-from utils.sql_utils import is_select_star
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Callable, Tuple, Sequence, Union
+
+# Statements that should normally be filtered by a WHERE clause.
+_DML_TYPES = (exp.Select, exp.Update, exp.Delete)
+
+# Column name suffixes (after the last "_") that suggest a numeric column.
+_NUMERIC_SUFFIXES = frozenset({"id", "count", "num", "qty"})
+
+def _looks_numeric(name: str) -> bool:
+    # Same as name.endswith(("_id", "_count", ...)) with one hash lookup;
+    # a bare "id" has no "_" separator and does not match.
+    _, sep, suffix = name.rpartition("_")
+    return bool(sep) and suffix in _NUMERIC_SUFFIXES
+
+def _has(node: Any, cls: type) -> bool:
+    """
+    True if node or any of its descendants is a `cls`.
+    Depth-first with an explicit stack, returning on the first hit.
+    """
+    stack: List[Any] = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, cls):
+            return True
+        stack.extend(current.iter_expressions())
+    return False
+
+@dataclass(slots=True)
+class Issue:
+    """A problem found in a query. Use to_dict() for JSON output."""
+    type: str
+    severity: str
+    message: str
+    code: str
+
+    def to_dict(self) -> Dict[str, str]:
+        return {
+            "type": self.type,
+            "severity": self.severity,
+            "message": self.message,
+            "code": self.code
+        }
+
+@dataclass
+class AnalysisContext:
+    """
+    Facts gathered about a query in a single AST walk.
+    Shared by the issue rules and the complexity score.
+    """
+    ast: exp.Expression
+    where: Optional[exp.Where] = None
+    is_select: bool = False
+    in_where: bool = False
+    joins: List[exp.Join] = field(default_factory=list)
+    subqueries: List[exp.Subquery] = field(default_factory=list)
+    unions: List[exp.Union] = field(default_factory=list)
+    intersects: List[exp.Intersect] = field(default_factory=list)
+    excepts: List[exp.Except] = field(default_factory=list)
+    findings: Dict[str, List[Issue]] = field(default_factory=dict)
+    issues: List[Issue] = field(default_factory=list)
+
+    def buckets(self) -> Dict[type, List[Any]]:
+        """
+        The structural node lists keyed by node type. Join, Subquery and the
+        set operations have no subclasses, so an exact-type lookup finds the bucket.
+        """
+        return {
+            exp.Join: self.joins,
+            exp.Subquery: self.subqueries,
+            exp.Union: self.unions,
+            exp.Intersect: self.intersects,
+            exp.Except: self.excepts,
+        }
+
+# Query features that decide which rules can fire (see build_context).
+_HAS_WHERE = 1
+_IS_SELECT = 2
+_MAY_HAVE_LIKE = 4
+_LIKE_RE = re.compile(r"LIKE", re.IGNORECASE)
+
+# A rule check: (node, ctx) -> issue message, or None when the rule does not fire.
+Check = Callable[[Any, "AnalysisContext"], Optional[str]]
+
+# Node class (or classes) a rule is anchored on; subclasses match too.
+Anchor = Union[type, Tuple[type, ...]]
+
+@dataclass(frozen=True, slots=True)
+class Rule:
+    """
+    An analyzer rule, anchored on the node type it inspects.
+
+    Rules with scope "node" are dispatched during the AST walk to every node
+    whose type matches `anchor`. Rules with scope "query" run once on the root
+    statement after the walk, when it matches `anchor`. `needs` lists the query
+    features (_HAS_WHERE, ...) without which the rule cannot fire; such rules
+    are left out of the dispatch. A `once` rule is reported at most once per query.
+    """
+    code: str
+    anchor: Anchor
+    type: str
+    severity: str
+    check: Check
+    scope: str = "node"
+    needs: int = 0
+    once: bool = False
+
+def _check_select_star(select: exp.Select, ctx: AnalysisContext) -> Optional[str]:
+    # 1. Check for SELECT *
+    # Checked inline on the projections rather than via is_select_star.
+    if any(type(p) is exp.Star for p in select.expressions):
+        return "Avoid using SELECT *, specify columns explicitly to reduce I/O."
+    return None
+
+def _check_missing_where(node: exp.Expression, ctx: AnalysisContext) -> Optional[str]:
+    # 2. Check for missing WHERE clause (potential full table scan)
+    # Only relevant for SELECT, UPDATE, DELETE
+    if not ctx.where:
+        # Exception: If it's a simple SELECT without joins, maybe it's intended, but still worth a warning for large tables
+        # If there are joins, it's definitely suspicious if there's no WHERE (though ON clauses handle joins)
+        return "Query has no WHERE clause, which may cause a full table scan."
+    return None
+
+def _check_like(like: exp.Like, ctx: AnalysisContext) -> Optional[str]:
+    # 3. Check for leading wildcards in LIKE
+    pattern = like.args.get("this")
+    if type(pattern) is exp.Literal and pattern.is_string and pattern.this.startswith("%"):
+        return "Leading wildcard in LIKE pattern ('%...') prevents index usage."
+    return None
+
+def _check_function_on_column(binary: exp.Binary, ctx: AnalysisContext) -> Optional[str]:
+    # 4. Check for functions on columns in WHERE clause
+    # Example: WHERE YEAR(date_col) = 2023
+    left = binary.left
+    if ctx.in_where and isinstance(left, exp.Func):
+        # And it involves a column
+        if _has(left, exp.Column):
+            return f"Function call {left.sql()} on column in WHERE clause may prevent index usage."
+    return None
+
+def _check_or(node: exp.Or, ctx: AnalysisContext) -> Optional[str]:
+    # 5. Check for OR conditions which might block index usage (simple heuristic)
+    if ctx.in_where:
+        return "OR conditions can sometimes prevent effective index usage. Consider UNION ALL if appropriate."
+    return None
+
+def _check_join_explosion(node: exp.Expression, ctx: AnalysisContext) -> Optional[str]:
+    # 6. Check for Join Explosion (Too many joins)
+    if len(ctx.joins) > 3:
+        return f"Query has {len(ctx.joins)} joins. Complex joins can be slow and hard to optimize."
+    return None
+
+def _check_not_in(node: exp.In, ctx: AnalysisContext) -> Optional[str]:
+    # 7. Check for NULL Pitfall (NOT IN with subquery)
+    # NOT IN (SELECT ...) returns NULL if any value in subquery is NULL, causing unexpected empty results.
+    if ctx.is_select and type(node.parent) is exp.Not and _has(node, exp.Subquery):
+        return "NOT IN with subquery is dangerous if subquery returns NULLs. Use NOT EXISTS or LEFT JOIN."
+    return None
+
+def _check_implicit_cast(binary: exp.Binary, ctx: AnalysisContext) -> Optional[str]:
+    # 8. Check for Implicit Casts (Heuristic)
+    # Look for string literals compared to likely numeric columns (ending in _id, _count, etc.)
+    # Column and Literal have no subclasses that matter here (only Pseudocolumn
+    # such as ROWNUM), so exact type checks are enough.
+    if not ctx.in_where:
+        return None
+    left = binary.left
+    right = binary.right
+    # Check left=col, right=string literal
+    if type(left) is exp.Column and type(right) is exp.Literal and right.is_string:
+        if _looks_numeric(left.name):
+            return f"Potential implicit cast: Comparing string '{right.this}' to likely numeric column '{left.name}'."
+    # Check left=string literal, right=col
+    elif type(right) is exp.Column and type(left) is exp.Literal and left.is_string:
+        if _looks_numeric(right.name):
+            return f"Potential implicit cast: Comparing string '{left.this}' to likely numeric column '{right.name}'."
+    return None
+
+def _check_limit_without_order(select: exp.Select, ctx: AnalysisContext) -> Optional[str]:
+    # 9. Check for N+1 Pattern (Heuristic)
+    # Queries that select from a table with a WHERE id = ? inside a loop (hard to detect static SQL, but can warn on simple ID lookups if context implies)
+    # Actually, a better static check is: SELECT * FROM table WHERE id IN (...) is better than many single lookups.
+    # But for single query analysis, we can't easily detect N+1 without seeing the application loop.
+    # Instead, let's detect "LIMIT 1" without ORDER BY which is often non-deterministic.
+    if select.args.get("limit") and not select.args.get("order"):
+        return "LIMIT used without ORDER BY causes non-deterministic results."
+    return None
+
+# Built-in rules. Issues are reported in this order, independent of the order
+# nodes are visited in.
+DEFAULT_RULES: Tuple[Rule, ...] = (
+    Rule("SELECT_STAR", exp.Select, "performance", "medium", _check_select_star, scope="query"),
+    Rule("MISSING_WHERE", _DML_TYPES, "performance", "high", _check_missing_where, scope="query"),
+    Rule("LEADING_WILDCARD", exp.Like, "performance", "high", _check_like, needs=_MAY_HAVE_LIKE),
+    Rule("FUNCTION_ON_COLUMN", exp.Binary, "performance", "medium", _check_function_on_column, needs=_HAS_WHERE),
+    Rule("OR_CONDITION", exp.Or, "performance", "low", _check_or, needs=_HAS_WHERE, once=True),
+    Rule("JOIN_EXPLOSION", exp.Expression, "performance", "medium", _check_join_explosion, scope="query"),
+    Rule("NULL_PITFALL", exp.In, "correctness", "high", _check_not_in, needs=_IS_SELECT),
+    Rule("IMPLICIT_CAST", exp.Binary, "performance", "medium", _check_implicit_cast, needs=_HAS_WHERE),
+    Rule("NON_DETERMINISTIC_LIMIT", exp.Select, "correctness", "low", _check_limit_without_order, scope="query"),
+)
 
 class QueryAnalyzer:
-    def analyze(self, ast: exp.Expression) -> List[Dict[str, Any]]:
-        issues = []
-        
-        # 1. Check for SELECT *
-        if is_select_star(ast):
-            issues.append({
-                "type": "performance",
-                "severity": "medium",
-                "message": "Avoid using SELECT *, specify columns explicitly to reduce I/O.",
-                "code": "SELECT_STAR"
-            })
-
-        # 2. Check for missing WHERE clause (potential full table scan)
-        # Only relevant for SELECT, UPDATE, DELETE
-        if isinstance(ast, (exp.Select, exp.Update, exp.Delete)):
-            if not ast.args.get("where"):
-                # Exception: If it's a simple SELECT without joins, maybe it's intended, but still worth a warning for large tables
-                # If there are joins, it's definitely suspicious if there's no WHERE (though ON clauses handle joins)
-                issues.append({
-                    "type": "performance",
-                    "severity": "high",
-                    "message": "Query has no WHERE clause, which may cause a full table scan.",
-                    "code": "MISSING_WHERE"
-                })
-
-        # 3. Check for leading wildcards in LIKE
-        for like in ast.find_all(exp.Like):
-            pattern = like.args.get("this")
-            if isinstance(pattern, exp.Literal) and pattern.is_string:
-                val = pattern.this
-                if val.startswith("%"):
-                    issues.append({
-                        "type": "performance",
-                        "severity": "high",
-                        "message": "Leading wildcard in LIKE pattern ('%...') prevents index usage.",
-                        "code": "LEADING_WILDCARD"
-                    })
-
-        # 4. Check for functions on columns in WHERE clause
-        # Example: WHERE YEAR(date_col) = 2023
-        if ast.args.get("where"):
-            where = ast.args.get("where")
-            for binary in where.find_all(exp.Binary):
-                left = binary.left
-                # If left side is a function call
-                if isinstance(left, exp.Func):
-                    # And it involves a column
-                    if any(left.find_all(exp.Column)):
-                        issues.append({
-                            "type": "performance",
-                            "severity": "medium",
-                            "message": f"Function call {left.sql()} on column in WHERE clause may prevent index usage.",
-                            "code": "FUNCTION_ON_COLUMN"
-                        })
-
-        # 5. Check for OR conditions which might block index usage (simple heuristic)
-        if ast.args.get("where"):
-            where = ast.args.get("where")
-            if list(where.find_all(exp.Or)):
-                 issues.append({
-                    "type": "performance",
-                    "severity": "low",
-                    "message": "OR conditions can sometimes prevent effective index usage. Consider UNION ALL if appropriate.",
-                    "code": "OR_CONDITION"
-                })
-
-        # 6. Check for Join Explosion (Too many joins)
-        joins = list(ast.find_all(exp.Join))
-        if len(joins) > 3:
-            issues.append({
-                "type": "performance",
-                "severity": "medium",
-                "message": f"Query has {len(joins)} joins. Complex joins can be slow and hard to optimize.",
-                "code": "JOIN_EXPLOSION"
-            })
-
-        # 7. Check for NULL Pitfall (NOT IN with subquery)
-        # NOT IN (SELECT ...) returns NULL if any value in subquery is NULL, causing unexpected empty results.
-        if isinstance(ast, exp.Select):
-            for not_in in ast.find_all(exp.In):
-                parent = not_in.parent
-                if isinstance(parent, exp.Not):
-                    if any(not_in.find_all(exp.Subquery)):
-                         issues.append({
-                            "type": "correctness",
-                            "severity": "high",
-                            "message": "NOT IN with subquery is dangerous if subquery returns NULLs. Use NOT EXISTS or LEFT JOIN.",
-                            "code": "NULL_PITFALL"
-                        })
-
-        # 8. Check for Implicit Casts (Heuristic)
-        # Look for string literals compared to likely numeric columns (ending in _id, _count, etc.)
-        where = ast.args.get("where")
-        if where:
-            for binary in where.find_all(exp.Binary):
-                left = binary.left
-                right = binary.right
-                
-                # Check left=col, right=string literal
-                if isinstance(left, exp.Column) and isinstance(right, exp.Literal) and right.is_string:
-                    if left.name.endswith(("_id", "_count", "_num", "_qty")):
-                         issues.append({
-                            "type": "performance",
-                            "severity": "medium",
-                            "message": f"Potential implicit cast: Comparing string '{right.this}' to likely numeric column '{left.name}'.",
-                            "code": "IMPLICIT_CAST"
-                        })
-                # Check left=string literal, right=col
-                elif isinstance(right, exp.Column) and isinstance(left, exp.Literal) and left.is_string:
-                    if right.name.endswith(("_id", "_count", "_num", "_qty")):
-                         issues.append({
-                            "type": "performance",
-                            "severity": "medium",
-                            "message": f"Potential implicit cast: Comparing string '{left.this}' to likely numeric column '{right.name}'.",
-                            "code": "IMPLICIT_CAST"
-                        })
-
-        # 9. Check for N+1 Pattern (Heuristic)
-        # Queries that select from a table with a WHERE id = ? inside a loop (hard to detect static SQL, but can warn on simple ID lookups if context implies)
-        # Actually, a better static check is: SELECT * FROM table WHERE id IN (...) is better than many single lookups.
-        # But for single query analysis, we can't easily detect N+1 without seeing the application loop.
-        # Instead, let's detect "LIMIT 1" without ORDER BY which is often non-deterministic.
-        if isinstance(ast, exp.Select):
-            limit = ast.args.get("limit")
-            order = ast.args.get("order")
-            if limit and not order:
-                 issues.append({
-                    "type": "correctness",
-                    "severity": "low",
-                    "message": "LIMIT used without ORDER BY causes non-deterministic results.",
-                    "code": "NON_DETERMINISTIC_LIMIT"
-                })
-
-        return issues
+    def __init__(self, rules: Optional[Sequence[Rule]] = None) -> None:
+        """
+        `rules` replaces the built-in rule set (DEFAULT_RULES), e.g. to disable
+        some checks or add custom ones.
+        """
+        self.rules: Tuple[Rule, ...] = tuple(DEFAULT_RULES if rules is None else rules)
+        self._node_rules = tuple(r for r in self.rules if r.scope == "node")
+        self._query_rules = tuple(r for r in self.rules if r.scope == "query")
+        # features -> node type -> rules, filled lazily
+        self._dispatch_cache: Dict[int, Dict[type, Tuple[Rule, ...]]] = {}
+
+    def _dispatch_table(self, features: int) -> Dict[type, Tuple[Rule, ...]]:
+        table = self._dispatch_cache.get(features)
+        if table is None:
+            table = self._dispatch_cache[features] = {}
+        return table
+
+    def _resolve_rules(self, node_type: type, features: int) -> Tuple[Rule, ...]:
+        rules = tuple(
+            r for r in self._node_rules
+            if r.needs & features == r.needs and issubclass(node_type, r.anchor)
+        )
+        self._dispatch_table(features)[node_type] = rules
+        return rules
+
+    def build_context(self, ast: exp.Expression, sql: Optional[str] = None) -> AnalysisContext:
+        """
+        Walks the AST once, dispatching each node to the rules anchored on its
+        type, then runs the query-level rules. The returned context holds the
+        issues and the structural node lists used by score_complexity.
+
+        Rules that cannot fire for this query (WHERE rules without a WHERE,
+        SELECT-only rules on other statements, LIKE rules when the raw `sql`
+        text has no LIKE) are left out of the dispatch for the whole walk.
+        """
+        ctx = AnalysisContext(
+            ast=ast,
+            where=ast.args.get("where"),
+            is_select=type(ast) is exp.Select,
+            findings={rule.code: [] for rule in self.rules},
+        )
+        findings = ctx.findings
+
+        features = 0
+        if ctx.where is not None:
+            features |= _HAS_WHERE
+        if ctx.is_select:
+            features |= _IS_SELECT
+        if sql is None or _LIKE_RE.search(sql):
+            features |= _MAY_HAVE_LIKE
+        dispatch = self._dispatch_table(features)
+        buckets = ctx.buckets()
+
+        # Binary/OR rules only apply to the top-level WHERE clause (including
+        # subqueries nested in it), so the flag is inherited by descendants.
+        where = ctx.where
+        stack: List[Tuple[Any, bool]] = [(ast, False)]
+        while stack:
+            node, in_where = stack.pop()
+            in_where = in_where or node is where
+            node_type = type(node)
+            bucket = buckets.get(node_type)
+            if bucket is not None:
+                bucket.append(node)
+            rules = dispatch.get(node_type)
+            if rules is None:
+                rules = self._resolve_rules(node_type, features)
+            if rules:
+                ctx.in_where = in_where
+                for rule in rules:
+                    found = findings[rule.code]
+                    if rule.once and found:
+                        continue
+                    message = rule.check(node, ctx)
+                    if message is not None:
+                        found.append(Issue(rule.type, rule.severity, message, rule.code))
+            stack.extend((child, in_where) for child in node.iter_expressions(reverse=True))
+
+        for rule in self._query_rules:
+            if isinstance(ast, rule.anchor):
+                message = rule.check(ast, ctx)
+                if message is not None:
+                    findings[rule.code].append(Issue(rule.type, rule.severity, message, rule.code))
+
+        ctx.issues = [issue for found in findings.values() for issue in found]
+        return ctx
+
+    def analyze(self, ast: exp.Expression, sql: Optional[str] = None) -> List[Issue]:
+        return self.build_context(ast, sql).issues
 
     def calculate_complexity_score(self, ast: exp.Expression) -> Dict[str, Any]:
         """
         Calculates a heuristic complexity score (1-10) for the query.
         Returns a dictionary with score and breakdown.
         """
+        return self.score_complexity(self._structure_context(ast))
+
+    def _structure_context(self, ast: exp.Expression) -> AnalysisContext:
+        """
+        Context with only the structural node lists filled in, collected in one
+        walk without running the issue rules. Used when only the score is needed.
+        """
+        ctx = AnalysisContext(ast=ast)
+        buckets = ctx.buckets()
+        stack: List[Any] = [ast]
+        while stack:
+            node = stack.pop()
+            bucket = buckets.get(type(node))
+            if bucket is not None:
+                bucket.append(node)
+            stack.extend(node.iter_expressions())
+        return ctx
+
+    def score_complexity(self, ctx: AnalysisContext) -> Dict[str, Any]:
+        """
+        Complexity score from an already built context (see build_context).
+        """
+        ast = ctx.ast
         score = 1
         breakdown = {
             "base": 1,
@@ -156,12 +334,12 @@ class QueryAnalyzer:
         }
         
         # +1 for each JOIN
-        joins = len(list(ast.find_all(exp.Join)))
+        joins = len(ctx.joins)
         score += joins
         breakdown["joins"] = joins
         
         # +1 for each Subquery
-        subqueries = len(list(ast.find_all(exp.Subquery)))
+        subqueries = len(ctx.subqueries)
         score += subqueries
         breakdown["subqueries"] = subqueries
         
@@ -181,10 +359,7 @@ class QueryAnalyzer:
             breakdown["having"] = 1
 
         # +2 for UNION / INTERSECT / EXCEPT
-        set_ops = 0
-        set_ops += len(list(ast.find_all(exp.Union))) * 2
-        set_ops += len(list(ast.find_all(exp.Intersect))) * 2
-        set_ops += len(list(ast.find_all(exp.Except))) * 2
+        set_ops = (len(ctx.unions) + len(ctx.intersects) + len(ctx.excepts)) * 2
         score += set_ops
         breakdown["set_ops"] = set_ops
 
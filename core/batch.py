@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Dict, Any, Iterable, Optional
+from core.dialect_detector import detect_dialect
+from core.parser import QueryParser
+from core.analyzer import QueryAnalyzer
+from core.indexer import IndexSuggester
+
+# One set of components per process (each worker imports this module).
+_parser = QueryParser()
+_analyzer = QueryAnalyzer()
+_indexer = IndexSuggester()
+
+def _analyze_one(sql: str, dialect: str = "auto") -> Dict[str, Any]:
+    """
+    Parses, analyzes and suggests indexes for a single query.
+    Returns a plain dict: ASTs stay in the worker, they are expensive to pickle.
+    """
+    if dialect == "auto":
+        dialect = detect_dialect(sql)
+
+    parse_result = _parser.parse(sql, dialect)
+    if "error" in parse_result:
+        return {"sql": sql, "dialect": dialect, "error": parse_result["error"]}
+
+    ast = parse_result["ast"]
+    analysis = _analyzer.build_context(ast, sql)
+    return {
+        "sql": sql,
+        "dialect": dialect,
+        "issues": [issue.to_dict() for issue in analysis.issues],
+        "complexity": _analyzer.score_complexity(analysis),
+        "index_suggestions": [s.to_dict() for s in _indexer.suggest_indexes(sql, dialect, ast=ast)],
+    }
+
+def analyze_many(sql_list: Iterable[str], dialect: str = "auto", max_workers: Optional[int] = None, chunksize: int = 32) -> List[Dict[str, Any]]:
+    """
+    Analyzes a workload of queries across CPU cores.
+
+    Parsing and AST walking are CPU-bound pure Python, so threads would be
+    serialized by the GIL; a process pool scales with the number of cores.
+    Queries are sent to workers in chunks of `chunksize` to amortize IPC.
+    Results are returned in input order. Workloads that fit in a single chunk
+    (or max_workers=1) are analyzed in-process, where a pool would only add
+    start-up cost.
+    """
+    sql_list = list(sql_list)
+    worker = partial(_analyze_one, dialect=dialect)
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if max_workers == 1 or len(sql_list) <= chunksize:
+        return [worker(sql) for sql in sql_list]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(worker, sql_list, chunksize=chunksize))
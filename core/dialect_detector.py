@@ -1,30 +1,42 @@
 import re
+from functools import lru_cache
 
+# All dialect fingerprints in one case-insensitive alternation, so the SQL is
+# scanned once (and never upper-cased) regardless of how many patterns exist.
+# The group name that matched tells detect_dialect which hint was found.
+_FINGERPRINT_RE = re.compile(
+    r"(?P<oracle>\b(?:NVL2?|ROWNUM|SYSDATE)\b)"
+    r"|(?P<tsql_top>\bTOP\s)"
+    r"|(?P<tsql>\bGETDATE\(\))"
+    r"|(?P<limit>\bLIMIT\b)"
+    r"|(?P<mysql>`)",
+    re.IGNORECASE,
+)
+
+@lru_cache(maxsize=256)
 def detect_dialect(sql: str) -> str:
     """
     Detects the SQL dialect based on specific keywords and patterns.
     Defaults to 'postgres' if no specific dialect is detected.
+    Memoized on the full SQL text, since a hint may appear anywhere in it.
     """
-    sql_upper = sql.upper()
+    found = set()
+    for match in _FINGERPRINT_RE.finditer(sql):
+        kind = match.lastgroup
+        # Oracle wins over every other hint, no need to scan further.
+        if kind == "oracle":
+            return "oracle"
+        found.add(kind)
 
-    # Oracle indicators
-    if "NVL" in sql_upper or "ROWNUM" in sql_upper or "SYSDATE" in sql_upper:
-        return "oracle"
-    
     # SQL Server indicators
-    if "TOP " in sql_upper and "LIMIT" not in sql_upper:
+    if "tsql_top" in found and "limit" not in found:
         return "tsql" # sqlglot uses tsql for SQL Server
-    if "GETDATE()" in sql_upper:
+    if "tsql" in found:
         return "tsql"
 
     # MySQL indicators
-    if "LIMIT" in sql_upper and "OFFSET" in sql_upper:
-        # PostgreSQL also uses LIMIT/OFFSET, but MySQL often uses backticks which we could check,
-        # but for now, let's look for other hints or default to postgres if ambiguous, 
-        # as postgres is a safe default for standard SQL.
-        pass
-    
-    if "`" in sql: # Backticks are strong indicator for MySQL
+    # PostgreSQL also uses LIMIT/OFFSET, so those are not a MySQL hint on their own.
+    if "mysql" in found: # Backticks are strong indicator for MySQL
         return "mysql"
 
     # PostgreSQL (default)
@@ -1,6 +1,20 @@
+import csv
 import re
 from typing import Dict, Any
 
+# PostgreSQL plan patterns, compiled once at import.
+_SEQ_SCAN_RE = re.compile(r"Seq Scan on (\w+)")
+_IDX_SCAN_RE = re.compile(r"Index Scan using (\w+) on (\w+)")
+# Cost, estimated rows and (with ANALYZE) actual rows of a plan node in one
+# match. The root node comes first, so the first match holds the totals.
+# Example: (cost=0.00..458.00 rows=10000 width=244) (actual time=0.012..0.012 rows=1 loops=1)
+_PLAN_METRICS_RE = re.compile(
+    r"cost=(?P<cmin>\d+\.\d+)\.\.(?P<cmax>\d+\.\d+) rows=(?P<erows>\d+)"
+    r"(?:[^\n]*?actual time=\S+ rows=(?P<arows>\d+))?"
+)
+# Actual rows on their own, for COSTS OFF output
+_ACTUAL_ROWS_RE = re.compile(r"actual time=.* rows=(\d+)")
+
 class ExplainParser:
     def parse(self, explain_output: str, dialect: str = "postgres") -> Dict[str, Any]:
         """
@@ -26,30 +40,31 @@ class ExplainParser:
         }
         
         # Regex for Seq Scan
-        seq_scans = re.findall(r"Seq Scan on (\w+)", output)
-        if seq_scans:
-            result["scans"].extend([{"type": "Seq Scan", "table": t} for t in seq_scans])
+        # finditer feeds the scan dicts directly, without an intermediate findall list.
+        result["scans"].extend(
+            {"type": "Seq Scan", "table": m.group(1)} for m in _SEQ_SCAN_RE.finditer(output)
+        )
             
         # Regex for Index Scan
-        idx_scans = re.findall(r"Index Scan using (\w+) on (\w+)", output)
-        if idx_scans:
-            result["scans"].extend([{"type": "Index Scan", "index": i, "table": t} for i, t in idx_scans])
+        result["scans"].extend(
+            {"type": "Index Scan", "index": m.group(1), "table": m.group(2)} for m in _IDX_SCAN_RE.finditer(output)
+        )
 
-        # Regex for Cost and Rows
-        # Example: (cost=0.00..458.00 rows=10000 width=244)
-        cost_match = re.search(r"cost=(\d+\.\d+)\.\.(\d+\.\d+)", output)
-        if cost_match:
-            result["total_cost"] = float(cost_match.group(2))
-            
-        rows_match = re.search(r"rows=(\d+)", output)
-        if rows_match:
-            result["estimated_rows"] = int(rows_match.group(1))
-            
-        # Actual rows (if ANALYZE used)
-        # Example: (actual time=0.012..0.012 rows=1 loops=1)
-        actual_rows_match = re.search(r"actual time=.* rows=(\d+)", output)
-        if actual_rows_match:
-            result["actual_rows"] = int(actual_rows_match.group(1))
+        # Cost and Rows, plus actual rows if ANALYZE was used, from a single search
+        actual_rows = None
+        metrics = _PLAN_METRICS_RE.search(output)
+        if metrics:
+            result["total_cost"] = float(metrics.group("cmax"))
+            result["estimated_rows"] = int(metrics.group("erows"))
+            actual_rows = metrics.group("arows")
+
+        # Actual rows without costs (EXPLAIN (ANALYZE, COSTS OFF))
+        if actual_rows is None:
+            actual_rows_match = _ACTUAL_ROWS_RE.search(output)
+            if actual_rows_match:
+                actual_rows = actual_rows_match.group(1)
+        if actual_rows is not None:
+            result["actual_rows"] = int(actual_rows)
 
         return result
 
@@ -61,27 +76,27 @@ class ExplainParser:
         
         # Simple tabular parsing
         # id | select_type | table | partitions | type | possible_keys | key | key_len | ref | rows | filtered | Extra
-        lines = output.strip().split('\n')
+        # Border rows (+----+) and separators are dropped up front; csv splits the cells in C.
+        lines = [line for line in output.strip().split('\n') if "|" in line and "---" not in line]
         headers = []
-        for line in lines:
-            if "select_type" in line and "table" in line:
-                headers = [h.strip() for h in line.split('|') if h.strip()]
+        for fields in csv.reader(lines, delimiter="|", quoting=csv.QUOTE_NONE):
+            parts = [p for p in map(str.strip, fields) if p]
+            if "select_type" in parts and "table" in parts:
+                headers = parts
                 continue
             
-            if headers and "|" in line and "---" not in line:
-                parts = [p.strip() for p in line.split('|') if p.strip()]
-                if len(parts) == len(headers):
-                    row = dict(zip(headers, parts))
-                    scan_info = {
-                        "table": row.get("table"),
-                        "type": row.get("type"),
-                        "key": row.get("key"),
-                        "rows": row.get("rows")
-                    }
-                    if row.get("type") == "ALL":
-                         scan_info["warning"] = "Full Table Scan"
-                    
-                    result["scans"].append(scan_info)
+            if headers and len(parts) == len(headers):
+                row = dict(zip(headers, parts))
+                scan_info = {
+                    "table": row.get("table"),
+                    "type": row.get("type"),
+                    "key": row.get("key"),
+                    "rows": row.get("rows")
+                }
+                if row.get("type") == "ALL":
+                     scan_info["warning"] = "Full Table Scan"
+                
+                result["scans"].append(scan_info)
         
         return result
 
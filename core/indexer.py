@@ -1,138 +1,212 @@
-import sqlglot
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field
 from sqlglot import exp
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Tuple, FrozenSet
+from utils.sql_utils import try_parse_sql
+
+# Clause flags carried down the AST walk in suggest_indexes.
+_IN_WHERE = 1
+_IN_JOIN_ON = 2
+_IN_GROUP = 4
+_IN_ORDER = 8
+
+# Suggestion priorities, ranked for deduplication.
+_PRIORITY = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
+
+@dataclass(slots=True)
+class Suggestion:
+    """A suggested index. Use to_dict() for JSON output."""
+    table: str
+    columns: Tuple[str, ...]
+    reason: str
+    priority: str
+    ddl: str = ""
+    _prio: int = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._prio = _PRIORITY[self.priority]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "table": self.table,
+            "columns": list(self.columns),
+            "reason": self.reason,
+            "priority": self.priority,
+            "ddl": self.ddl
+        }
 
 class IndexSuggester:
-    def suggest_indexes(self, sql: str, dialect: str = "postgres") -> List[Dict[str, Any]]:
-        try:
-            parsed = sqlglot.parse_one(sql, read=dialect)
-        except:
+    def suggest_indexes(self, sql: str, dialect: str = "postgres", ast: Optional[exp.Expression] = None) -> List[Suggestion]:
+        """
+        Suggests indexes for the query. Pass `ast` when the query has already
+        been parsed to skip parsing it again. The AST is only read, never
+        modified.
+        """
+        parsed = ast if ast is not None else try_parse_sql(sql, dialect)[0]
+        if parsed is None:
             return []
 
-        suggestions = []
-        
+        suggestions: List[Suggestion] = []
+
+        # Walk the AST once, bucketing columns by the clause that encloses them.
+        # Tables are collected on the way so unqualified columns can be resolved
+        # afterwards, and EQ predicates joined by AND in the WHERE clause are kept
+        # for the composite index check.
+        where = parsed.args.get("where")
+        group = parsed.args.get("group")
+        order = parsed.args.get("order")
+        tables: List[str] = []
+        where_cols: List[Any] = []
+        join_cols: List[Any] = []
+        group_cols: List[Any] = []
+        order_cols: List[Any] = []
+        where_and_eqs: List[Any] = []
+
+        # Exact type checks: none of these node classes are subclassed in a way
+        # that matters here. Pseudocolumns (e.g. Oracle ROWNUM) are skipped on
+        # purpose since they cannot be indexed.
+        Column, Table, EQ, And, Join = exp.Column, exp.Table, exp.EQ, exp.And, exp.Join
+        stack: List[Tuple[Any, int]] = [(parsed, 0)]
+        while stack:
+            node, clauses = stack.pop()
+            if node is where:
+                clauses |= _IN_WHERE
+            elif node is group:
+                clauses |= _IN_GROUP
+            elif node is order:
+                clauses |= _IN_ORDER
+
+            node_type = type(node)
+            if node_type is Column:
+                if clauses & _IN_WHERE:
+                    where_cols.append(node)
+                if clauses & _IN_JOIN_ON:
+                    join_cols.append(node)
+                if clauses & _IN_GROUP:
+                    group_cols.append(node)
+                if clauses & _IN_ORDER:
+                    order_cols.append(node)
+                continue # Only identifiers below a column
+            if node_type is Table:
+                tables.append(node.name)
+            elif node_type is EQ and clauses & _IN_WHERE and type(node.parent) is And:
+                where_and_eqs.append(node)
+
+            if node_type is Join:
+                on = node.args.get("on")
+                stack.extend(
+                    (child, clauses | _IN_JOIN_ON if child is on else clauses)
+                    for child in node.iter_expressions(reverse=True)
+                )
+            else:
+                stack.extend((child, clauses) for child in node.iter_expressions(reverse=True))
+
         # Helper to resolve table name
-        tables = [t.name for t in parsed.find_all(exp.Table)]
         default_table = tables[0] if len(tables) == 1 else None
 
-        def get_table_name(column: exp.Column) -> str:
+        def get_table_name(column: exp.Column) -> Optional[str]:
             if column.table:
                 return column.table
             return default_table
 
         # 1. Analyze WHERE clause
-        where = parsed.args.get("where")
-        if where:
-            for column in where.find_all(exp.Column):
-                table = get_table_name(column)
-                col_name = column.name
-                if table:
-                    suggestions.append({
-                        "table": table,
-                        "columns": [col_name],
-                        "reason": "Column used in WHERE clause filter.",
-                        "priority": "high"
-                    })
+        for column in where_cols:
+            table = get_table_name(column)
+            col_name = sys.intern(column.name)
+            if table:
+                suggestions.append(Suggestion(
+                    table=table,
+                    columns=(col_name,),
+                    reason="Column used in WHERE clause filter.",
+                    priority="high"
+                ))
 
         # 2. Analyze JOIN ON clauses
-        for join in parsed.find_all(exp.Join):
-            on = join.args.get("on")
-            if on:
-                for column in on.find_all(exp.Column):
-                    table = get_table_name(column)
-                    col_name = column.name
-                    if table:
-                        suggestions.append({
-                            "table": table,
-                            "columns": [col_name],
-                            "reason": "Column used in JOIN condition.",
-                            "priority": "high"
-                        })
+        for column in join_cols:
+            table = get_table_name(column)
+            col_name = sys.intern(column.name)
+            if table:
+                suggestions.append(Suggestion(
+                    table=table,
+                    columns=(col_name,),
+                    reason="Column used in JOIN condition.",
+                    priority="high"
+                ))
 
         # 3. Analyze GROUP BY
-        group = parsed.args.get("group")
-        if group:
-            for column in group.find_all(exp.Column):
-                table = get_table_name(column)
-                col_name = column.name
-                if table:
-                    suggestions.append({
-                        "table": table,
-                        "columns": [col_name],
-                        "reason": "Column used in GROUP BY.",
-                        "priority": "medium"
-                    })
+        for column in group_cols:
+            table = get_table_name(column)
+            col_name = sys.intern(column.name)
+            if table:
+                suggestions.append(Suggestion(
+                    table=table,
+                    columns=(col_name,),
+                    reason="Column used in GROUP BY.",
+                    priority="medium"
+                ))
 
         # 4. Analyze ORDER BY
-        order = parsed.args.get("order")
-        if order:
-            for column in order.find_all(exp.Column):
-                table = get_table_name(column)
-                col_name = column.name
-                if table:
-                    suggestions.append({
-                        "table": table,
-                        "columns": [col_name],
-                        "reason": "Column used in ORDER BY.",
-                        "priority": "low"
-                    })
+        for column in order_cols:
+            table = get_table_name(column)
+            col_name = sys.intern(column.name)
+            if table:
+                suggestions.append(Suggestion(
+                    table=table,
+                    columns=(col_name,),
+                    reason="Column used in ORDER BY.",
+                    priority="low"
+                ))
 
         # 5. Analyze AND conditions for Composite Indexes
         # Heuristic: If multiple columns are used in AND equality predicates in WHERE, suggest a composite index.
-        if where:
-            and_columns = []
-            for binary in where.find_all(exp.And):
-                # Check left and right sides
-                for node in [binary.left, binary.right]:
-                    if isinstance(node, exp.EQ):
-                        # Check if it's a column
-                        cols = list(node.find_all(exp.Column))
-                        if len(cols) == 1:
-                            col = cols[0]
-                            table = get_table_name(col)
-                            if table:
-                                and_columns.append((table, col.name))
-            
-            # Group by table
-            table_cols = {}
-            for table, col in and_columns:
-                if table not in table_cols:
-                    table_cols[table] = set()
-                table_cols[table].add(col)
-            
-            for table, cols in table_cols.items():
-                if len(cols) > 1:
-                    col_list = list(cols)
-                    suggestions.append({
-                        "table": table,
-                        "columns": col_list,
-                        "reason": "Columns used together in AND equality predicates. Composite index recommended.",
-                        "priority": "critical"
-                    })
+        # Columns are grouped by table in first-seen order (dict keys) so the DDL is stable.
+        table_cols: Dict[str, Dict[str, None]] = {}
+        for node in where_and_eqs:
+            # Check if it's a column
+            cols = list(node.find_all(exp.Column))
+            if len(cols) == 1:
+                col = cols[0]
+                table = get_table_name(col)
+                if table:
+                    table_cols.setdefault(table, {})[col.name] = None
+
+        for table, col_names in table_cols.items():
+            if len(col_names) > 1:
+                col_list = list(col_names)
+                suggestions.append(Suggestion(
+                    table=table,
+                    columns=tuple(col_list),
+                    reason="Columns used together in AND equality predicates. Composite index recommended.",
+                    priority="critical"
+                ))
 
         # 6. Analyze Covering Indexes
         # Check if we can satisfy the query using only the index (SELECT cols + WHERE cols)
         # This is hard to do perfectly without schema, but we can suggest it if SELECT list is small.
         if isinstance(parsed, exp.Select):
-            select_cols = set()
-            for col in parsed.expressions:
-                if isinstance(col, exp.Column):
-                    select_cols.add(col.name)
-                elif isinstance(col, exp.Star):
-                    select_cols = None # Can't determine covering index for SELECT *
-                    break
-            
+            # Can't determine covering index for SELECT * (or t.*)
+            select_cols: Dict[str, None] = {} if parsed.is_star else {
+                col.name: None for col in parsed.expressions if type(col) is exp.Column
+            }
+
             if select_cols:
                 # Check against WHERE columns for each table
-                where_cols_by_table = {}
-                if where:
-                    for col in where.find_all(exp.Column):
-                        t = get_table_name(col)
-                        if t:
-                            if t not in where_cols_by_table:
-                                where_cols_by_table[t] = set()
-                            where_cols_by_table[t].add(col.name)
+                where_cols_by_table: Dict[str, Set[str]] = {}
+                for col in where_cols:
+                    t = get_table_name(col)
+                    if t:
+                        if t not in where_cols_by_table:
+                            where_cols_by_table[t] = set()
+                        where_cols_by_table[t].add(col.name)
                 
+                # High/critical suggestions per table, bucketed once instead of
+                # rescanning every suggestion for each WHERE table.
+                by_table_high: Dict[str, List[Suggestion]] = defaultdict(list)
+                for s in suggestions:
+                    if s.priority in ('high', 'critical'):
+                        by_table_high[s.table].append(s)
+
                 for table, w_cols in where_cols_by_table.items():
                     # If all select cols for this table are in w_cols or we add them...
                     # Actually covering index = WHERE cols + SELECT cols
@@ -141,20 +215,19 @@ class IndexSuggester:
                     # suggest adding the SELECT columns to it to make it covering.
                     
                     # Find existing suggestions for this table
-                    existing = [s for s in suggestions if s['table'] == table and s['priority'] in ('high', 'critical')]
-                    for s in existing:
+                    for s in by_table_high.get(table, ()):
                         # If the index columns don't already cover the select columns
-                        idx_cols = set(s['columns'])
-                        missing = select_cols - idx_cols
+                        idx_cols = set(s.columns)
+                        missing = [c for c in select_cols if c not in idx_cols]
                         # Filter missing to likely belong to this table (heuristic: if unique name or we assume)
                         # Without schema, this is risky. Let's just suggest if it's a small number of extra cols.
                         if missing and len(missing) < 3:
-                             suggestions.append({
-                                "table": table,
-                                "columns": s['columns'] + list(missing),
-                                "reason": f"Extend index to include {list(missing)} for a Covering Index (avoids table lookup).",
-                                "priority": "medium"
-                            })
+                             suggestions.append(Suggestion(
+                                table=table,
+                                columns=s.columns + tuple(missing),
+                                reason=f"Extend index to include {missing} for a Covering Index (avoids table lookup).",
+                                priority="medium"
+                            ))
 
         # 7. Suggest Foreign Key Indexes
         # Heuristic: Columns ending in _id are likely FKs and should be indexed for joins/lookups.
@@ -168,27 +241,21 @@ class IndexSuggester:
              # Let's stick to what's in the query.
              pass
 
-        # Deduplicate and format suggestions
-        unique_suggestions = {}
+        # Deduplicate suggestions
+        # Keyed on the column set, so composite indexes match regardless of column order.
+        unique_suggestions: Dict[Tuple[str, FrozenSet[str]], Suggestion] = {}
         for s in suggestions:
-            # Sort columns for consistent key in composite indexes
-            cols_key = ",".join(sorted(s['columns']))
-            key = f"{s['table']}:{cols_key}"
+            key = (s.table, frozenset(s.columns))
             
-            # Generate DDL
-            # Name convention: idx_<table>_<col1>_<col2>
-            idx_name = f"idx_{s['table']}_{'_'.join(s['columns'])[:40]}"
-            ddl = f"CREATE INDEX {idx_name} ON {s['table']} ({', '.join(s['columns'])});"
-            s['ddl'] = ddl
-            
-            if key not in unique_suggestions:
+            existing = unique_suggestions.get(key)
+            # Upgrade priority if found again
+            if existing is None or s._prio > existing._prio:
                 unique_suggestions[key] = s
-            else:
-                # Upgrade priority if found again
-                current_p = unique_suggestions[key]['priority']
-                new_p = s['priority']
-                priorities = {'low': 1, 'medium': 2, 'high': 3, 'critical': 4}
-                if priorities.get(new_p, 0) > priorities.get(current_p, 0):
-                    unique_suggestions[key] = s
+
+        # Generate DDL for the surviving suggestions only
+        # Name convention: idx_<table>_<col1>_<col2>
+        for s in unique_suggestions.values():
+            idx_name = f"idx_{s.table}_{'_'.join(s.columns)[:40]}"
+            s.ddl = f"CREATE INDEX {idx_name} ON {s.table} ({', '.join(s.columns)});"
 
         return list(unique_suggestions.values())
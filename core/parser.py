@@ -1,33 +1,40 @@
-import sqlglot
 from sqlglot import exp
 from typing import Dict, Any, List, Optional
-from utils.sql_utils import get_tables, get_columns
+from utils.sql_utils import scan, to_sql, try_parse_sql
 
 class QueryParser:
     def __init__(self):
         pass
 
-    def parse(self, sql: str, dialect: str = "postgres") -> Dict[str, Any]:
+    def parse(self, sql: str, dialect: str = "postgres", normalize: bool = False) -> Dict[str, Any]:
         """
         Parses SQL and returns an AST and metadata breakdown.
+        Set normalize=True to also get the AST rendered back to SQL as
+        `sql_normalized`; rendering costs about as much as parsing, so it is
+        skipped by default.
+        The returned AST is cached and shared with later parse() calls (and the
+        analyzer, rewriter and indexer): treat it as read-only, or work on
+        `ast.copy()`.
         """
-        try:
-            parsed = sqlglot.parse_one(sql, read=dialect)
-        except Exception as e:
-            return {"error": f"Failed to parse SQL: {str(e)}"}
+        parsed, error = try_parse_sql(sql, dialect)
+        if parsed is None:
+            return {"error": f"Failed to parse SQL: {error}"}
 
+        scanned = scan(parsed)
         metadata = {
-            "tables": get_tables(parsed),
-            "columns": get_columns(parsed),
+            "tables": scanned["tables"],
+            "columns": scanned["columns"],
             "query_type": parsed.key.upper() if parsed else "UNKNOWN",
             "parts": self._extract_parts(parsed)
         }
         
-        return {
+        result = {
             "ast": parsed, # Note: AST object is not JSON serializable directly, handled in server or analyzer
             "metadata": metadata,
-            "sql_normalized": parsed.sql(dialect=dialect)
         }
+        if normalize:
+            result["sql_normalized"] = to_sql(parsed, dialect)
+        return result
 
     def _extract_parts(self, expression: exp.Expression) -> Dict[str, str]:
         parts = {}
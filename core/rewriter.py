@@ -1,90 +1,243 @@
-import sqlglot
 from sqlglot import exp
-from sqlglot.optimizer import optimize
-from typing import Optional, Dict, List
+import inspect
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.optimizer import RULES
+from sqlglot.schema import ensure_schema
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Optional, Dict, List, FrozenSet, Mapping, Set, Tuple
+from utils.sql_utils import get_dialect, to_sql, try_parse_sql
+
+# sqlglot's default optimizer pipeline, with each rule's keyword parameters
+# resolved once. sqlglot.optimizer.optimize inspects every rule's signature on
+# every call. qualify stays first: the other rules need qualified columns.
+_OPTIMIZER_ARGS = ("db", "catalog", "schema", "dialect", "sql", "isolate_tables", "quote_identifiers")
+_PIPELINE = tuple(
+    (rule, tuple(p for p in inspect.getfullargspec(rule).args if p in _OPTIMIZER_ARGS))
+    for rule in RULES
+)
+
+def _optimize(expression: exp.Expression, schema: Optional[Dict[str, Any]], dialect: Dialect) -> exp.Expression:
+    """Same as sqlglot.optimizer.optimize(expression, schema=schema, dialect=dialect)."""
+    args: Dict[str, Any] = {
+        "db": None,
+        "catalog": None,
+        "schema": ensure_schema(schema, dialect=dialect),
+        "dialect": dialect,
+        "sql": None,
+        "isolate_tables": True,
+        "quote_identifiers": False,
+    }
+    optimized: Any = expression.copy()
+    for rule, params in _PIPELINE:
+        optimized = rule(optimized, **{p: args[p] for p in params})
+    return optimized
+
+# Node types the optimizer has nothing to rewrite in, short of qualifying and
+# quoting names. Queries made only of these (e.g. SELECT name FROM users ORDER
+# BY name LIMIT 10) are returned unchanged without optimizing.
+_PLAIN_NODES = frozenset((
+    exp.Select, exp.From, exp.Table, exp.TableAlias, exp.Column, exp.Identifier,
+    exp.Star, exp.Alias, exp.Order, exp.Ordered, exp.Limit, exp.Literal,
+))
+
+def _is_plain(ast: exp.Expression) -> bool:
+    node: Any
+    for node in ast.walk():
+        if type(node) not in _PLAIN_NODES:
+            return False
+    return True
+
+def _needs_rewrite(ast: exp.Expression, schema_key: "SchemaKey") -> bool:
+    # With a schema there is always something to do (e.g. expanding SELECT *).
+    return schema_key is not None or not _is_plain(ast)
+
+# Hashable stand-in for a schema dict, used as part of the rewrite cache key:
+# (table, ((column, type), ...)) pairs, in the schema's own column order.
+SchemaKey = Optional[FrozenSet[Tuple[str, Tuple[Tuple[str, str], ...]]]]
+
+def _schema_columns(columns: Any) -> Optional[Tuple[Tuple[str, str], ...]]:
+    # [column, ...] (types unknown) or sqlglot's own {column: type}
+    if isinstance(columns, Mapping):
+        items = tuple(columns.items())
+        if all(isinstance(c, str) and isinstance(t, str) for c, t in items):
+            return items
+    elif isinstance(columns, (list, tuple)):
+        if all(isinstance(c, str) for c in columns):
+            return tuple((c, "UNKNOWN") for c in columns)
+    return None
+
+def _schema_key(schema: Any) -> SchemaKey:
+    # Anything but {table: [column, ...]} or {table: {column: type}} is ignored
+    # up front: sqlglot would only reject it after part of the optimization has
+    # run, and not always with a SqlglotError.
+    if not isinstance(schema, Mapping):
+        return None
+    key = []
+    for table, columns in schema.items():
+        items = _schema_columns(columns)
+        if not isinstance(table, str) or items is None:
+            return None
+        key.append((table, items))
+    return frozenset(key)
+
+# (optimized_sql, original_ast, optimized_ast); the ASTs are None if parsing failed.
+RewriteResult = Tuple[str, Optional[exp.Expression], Optional[exp.Expression]]
+
+@lru_cache(maxsize=512)
+def _rewrite_cached(sql: str, dialect: str, schema_key: SchemaKey) -> RewriteResult:
+    """
+    QueryRewriter.rewrite_with_ast, memoized on (sql, dialect, schema). MCP clients
+    often replay the same query, and a hit skips parse, optimize and generate.
+    """
+    parsed, _ = try_parse_sql(sql, dialect)
+    if parsed is None:
+        return sql, None, None # Return original if parse fails
+
+    if not _needs_rewrite(parsed, schema_key):
+        return sql, parsed, parsed
+
+    # If schema is provided, we can use it to expand stars and qualify columns
+    # Schema format expected by sqlglot is slightly different usually, but let's try to adapt if needed.
+    # For now, we'll just run the standard optimizer which does:
+    # - Predicate pushdown
+    # - Simplification
+    # - Unnesting subqueries (sometimes)
+
+    # Note: the optimizer takes 'schema' as a dict of table -> {column: type}
+    # to help with qualification; list schemas have their types as "UNKNOWN".
+    schema = None if schema_key is None else {
+        table: dict(columns) for table, columns in schema_key
+    }
+
+    try:
+        # _optimize() works on a copy, so the shared cached AST is left untouched.
+        optimized = _optimize(parsed, schema, get_dialect(dialect))
+        return to_sql(optimized, dialect, pretty=True), parsed, optimized
+    except SqlglotError:
+        # Fallback if optimization fails (e.g. unresolvable columns or unsupported syntax)
+        return sql, parsed, parsed
+
+# Improvements reported by get_improvements, as bit flags in report order.
+_SIMPLIFIED = 1
+_TO_JOIN = 2
+_TO_UNION_ALL = 4
+_NO_TAUTOLOGY = 8
+_PUSHDOWN = 16
+_IMPROVEMENTS = (
+    (_SIMPLIFIED, "Query simplified (syntax reduction)."),
+    (_TO_JOIN, "Converted correlated subqueries to JOINs (improves execution plan)."),
+    (_TO_UNION_ALL, "Replaced OR conditions with UNION ALL (enables index usage per branch)."),
+    (_NO_TAUTOLOGY, "Removed tautologies (1=1) to simplify predicate evaluation."),
+    (_PUSHDOWN, "Applied predicate pushdown and join optimization rules."),
+)
+
+# estimate_cost_reduction messages, indexed by the complexity score difference.
+# Heuristic: Each point is roughly 10-15% improvement in "structural" cost,
+# capped at 90% (reached at a difference of 6).
+_NO_COST_REDUCTION = "No significant structural complexity reduction detected."
+_COST_REDUCTIONS = tuple(
+    f"Estimated structural complexity reduction: ~{min(diff * 15, 90)}%" for diff in range(7)
+)
+
+@dataclass(slots=True)
+class _AstSummary:
+    """What get_improvements needs to know about an AST."""
+    nodes: int
+    kinds: Set[type]
+    union_all: bool
+    tautology: bool
+
+def _summarize(ast: exp.Expression) -> _AstSummary:
+    """Collects an _AstSummary in a single walk."""
+    summary = _AstSummary(nodes=0, kinds=set(), union_all=False, tautology=False)
+    node: Any
+    for node in ast.walk():
+        summary.nodes += 1
+        node_type = type(node)
+        summary.kinds.add(node_type)
+        if node_type is exp.Union and not node.args.get("distinct"):
+            summary.union_all = True
+        elif node_type is exp.EQ:
+            # Literal compared to an identical literal, e.g. 1=1
+            left, right = node.left, node.right
+            if type(left) is exp.Literal and left == right:
+                summary.tautology = True
+    return summary
 
 class QueryRewriter:
-    def rewrite(self, sql: str, dialect: str = "postgres", schema: Optional[Dict[str, List[str]]] = None) -> str:
+    def rewrite(self, sql: str, dialect: str = "postgres", schema: Optional[Dict[str, Any]] = None) -> str:
         """
         Rewrites the SQL query to be more optimized using sqlglot's optimizer.
+        Results are cached per (sql, dialect, schema).
         """
-        try:
-            parsed = sqlglot.parse_one(sql, read=dialect)
-        except:
-            return sql # Return original if parse fails
-
-        # If schema is provided, we can use it to expand stars and qualify columns
-        # Schema format expected by sqlglot is slightly different usually, but let's try to adapt if needed.
-        # For now, we'll just run the standard optimizer which does:
-        # - Predicate pushdown
-        # - Simplification
-        # - Unnesting subqueries (sometimes)
-        
-        # Note: sqlglot.optimizer.optimize takes 'schema' as a dict of table -> columns
-        # to help with qualification.
-        
-        try:
-            optimized = optimize(parsed, schema=schema, dialect=dialect)
-            return optimized.sql(dialect=dialect, pretty=True)
-        except Exception as e:
-            # Fallback if optimization fails (e.g. schema mismatch or complex query)
-            return sql
+        return _rewrite_cached(sql, dialect, _schema_key(schema))[0]
+
+    def rewrite_with_ast(self, sql: str, dialect: str = "postgres", schema: Optional[Dict[str, Any]] = None) -> RewriteResult:
+        """
+        Like rewrite(), but also returns the original and optimized ASTs so
+        callers can inspect them without parsing either SQL again.
+        Both ASTs are None if the SQL could not be parsed. They are shared with
+        the cache and must be treated as read-only.
+        """
+        return _rewrite_cached(sql, dialect, _schema_key(schema))
 
-    def get_improvements(self, original_sql: str, optimized_sql: str) -> List[str]:
+    def get_improvements(self, orig_ast: exp.Expression, opt_ast: exp.Expression) -> List[str]:
         """
-        Compares original and optimized SQL to list applied improvements.
+        Compares the original and optimized ASTs (see rewrite_with_ast) to list
+        applied improvements. Each AST is walked once.
         """
-        improvements = []
-        
-        # Normalize for comparison (remove whitespace diffs)
-        orig_norm = " ".join(original_sql.split())
-        opt_norm = " ".join(optimized_sql.split())
-        
-        if len(opt_norm) < len(orig_norm):
-             improvements.append("Query simplified (syntax reduction).")
-        
-        if "JOIN" in optimized_sql and "JOIN" not in original_sql:
-             improvements.append("Converted correlated subqueries to JOINs (improves execution plan).")
-             
-        if "UNION ALL" in optimized_sql and "OR" in original_sql and "UNION ALL" not in original_sql:
-             improvements.append("Replaced OR conditions with UNION ALL (enables index usage per branch).")
-
-        if "1=1" in original_sql and "1=1" not in optimized_sql:
-             improvements.append("Removed tautologies (1=1) to simplify predicate evaluation.")
+        if opt_ast is orig_ast:
+            return [] # Nothing was rewritten
+        orig = _summarize(orig_ast)
+        opt = _summarize(opt_ast)
+        flags = 0
+
+        if opt.nodes < orig.nodes:
+             flags |= _SIMPLIFIED
+
+        if exp.Join in opt.kinds and exp.Join not in orig.kinds:
+             flags |= _TO_JOIN
+
+        if opt.union_all and exp.Or in orig.kinds and not orig.union_all:
+             flags |= _TO_UNION_ALL
+
+        if orig.tautology and not opt.tautology:
+             flags |= _NO_TAUTOLOGY
 
         # Heuristic for Predicate Pushdown:
         # If WHERE clause exists in optimized but was implicit or different in original (hard to detect exactly)
         # But we can check if we have JOINs and WHERE clauses.
         # Simple check: If optimized SQL has WHERE and original didn't (unlikely for pushdown, usually it's moving WHERE)
         # Let's just add a generic note if we optimized a JOIN query.
-        if "JOIN" in optimized_sql:
-             improvements.append("Applied predicate pushdown and join optimization rules.")
+        if exp.Join in opt.kinds:
+             flags |= _PUSHDOWN
 
-        return improvements
+        return [message for bit, message in _IMPROVEMENTS if flags & bit]
 
     def estimate_cost_reduction(self, original_complexity: int, optimized_complexity: int) -> str:
         """
         Estimates the cost reduction based on complexity score difference.
         """
-        if original_complexity <= optimized_complexity:
-            return "No significant structural complexity reduction detected."
-            
         diff = original_complexity - optimized_complexity
-        # Heuristic: Each point is roughly 10-15% improvement in "structural" cost
-        percent = min(diff * 15, 90)
-        
-        return f"Estimated structural complexity reduction: ~{percent}%"
+        if diff <= 0:
+            return _NO_COST_REDUCTION
+        return _COST_REDUCTIONS[min(diff, len(_COST_REDUCTIONS) - 1)]
 
-    def generate_alternatives(self, sql: str, dialect: str = "postgres") -> List[Dict[str, str]]:
+    def generate_alternatives(self, sql: str, dialect: str = "postgres", parsed: Optional[exp.Expression] = None) -> List[Dict[str, str]]:
         """
         Generates alternative versions of the query using different optimization strategies.
+        Pass `parsed` (e.g. the original AST from rewrite_with_ast) to skip parsing `sql` again.
         """
-        alternatives = []
-        
-        try:
-            parsed = sqlglot.parse_one(sql, read=dialect)
-        except:
-            return []
+        alternatives: List[Dict[str, str]] = []
+        if parsed is None:
+            parsed, _ = try_parse_sql(sql, dialect)
+            if parsed is None:
+                return []
+
+        if _is_plain(parsed):
+            return alternatives # Trivial query, nothing to offer
 
         # Alternative 1: CTE Refactoring (Common Table Expressions)
         # Moves subqueries to CTEs for better readability and potential materialization
@@ -105,7 +258,7 @@ class QueryRewriter:
             # Let's offer a "No-Op / Formatting Only" alternative for comparison.
             alternatives.append({
                 "name": "Formatted Only",
-                "sql": parsed.sql(dialect=dialect, pretty=True),
+                "sql": to_sql(parsed, dialect, pretty=True),
                 "description": "Cleanly formatted original query without structural changes."
             })
             
@@ -118,7 +271,7 @@ class QueryRewriter:
             #     "description": "Ensures all identifiers are quoted to prevent keyword conflicts."
             # })
             
-        except:
+        except SqlglotError:
             pass
             
         return alternatives
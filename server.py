@@ -1,12 +1,15 @@
+import asyncio
 from mcp.server.fastmcp import FastMCP
+from mcp.types import TextContent
 from core.dialect_detector import detect_dialect
 from core.parser import QueryParser
-from core.analyzer import QueryAnalyzer
+from core.analyzer import QueryAnalyzer, Issue
 from core.rewriter import QueryRewriter
 from core.indexer import IndexSuggester
 from core.explain_parser import ExplainParser
 from utils.formatting import format_json_response, create_table_comparison
-from typing import Optional, Dict, Any
+from utils.sql_utils import parse_sql, to_sql
+from typing import Optional, Dict, Any, List, Tuple
 
 # Initialize FastMCP server
 mcp = FastMCP("sql-optimizer")
@@ -18,80 +21,58 @@ rewriter = QueryRewriter()
 indexer = IndexSuggester()
 explain_parser = ExplainParser()
 
-@mcp.tool()
-def analyze_query(sql: str, dialect: str = "auto", schema: Optional[str] = None, explain_plan: Optional[str] = None) -> str:
-    """
-    Analyzes a SQL query for performance issues and inefficiencies.
-    
-    Args:
-        sql: The SQL query to analyze.
-        dialect: The SQL dialect (postgresql, mysql, oracle, sqlserver, auto).
-        schema: Optional schema definition (not fully used in this version).
-        explain_plan: Optional text output from an EXPLAIN command.
-    """
-    if dialect == "auto":
-        dialect = detect_dialect(sql)
+def _respond(data: Any) -> List[TextContent]:
+    # The JSON text is returned as the tool's content as is; tools are
+    # registered with structured_output=False so FastMCP does not also wrap
+    # the payload as structured output and serialize it a second time.
+    return [TextContent(type="text", text=format_json_response(data))]
 
-    # Parse
-    parse_result = parser.parse(sql, dialect)
-    if "error" in parse_result:
-        return format_json_response({"error": parse_result["error"]})
+def _analyze_ast(ast: Any, sql: str) -> Tuple[List[Issue], Dict[str, Any]]:
+    # One walk feeds both the issue rules and the complexity score
+    analysis = analyzer.build_context(ast, sql)
+    return analysis.issues, analyzer.score_complexity(analysis)
 
-    ast = parse_result["ast"]
-    
-    # Analyze
-    issues = analyzer.analyze(ast)
-    complexity_data = analyzer.calculate_complexity_score(ast)
-    
-    # Explain Plan Analysis
-    explain_analysis = {}
-    explain_visualization = ""
-    if explain_plan:
-        explain_analysis = explain_parser.parse(explain_plan, dialect)
-        explain_visualization = explain_parser.visualize_plan(explain_analysis)
+def _analyze_explain(explain_plan: str, dialect: str) -> Tuple[Dict[str, Any], str]:
+    explain_analysis = explain_parser.parse(explain_plan, dialect)
+    return explain_analysis, explain_parser.visualize_plan(explain_analysis)
 
-    response = {
+async def _explain(explain_plan: Optional[str], dialect: str) -> Tuple[Dict[str, Any], str]:
+    # No thread hand-off when there is no plan to analyze
+    if not explain_plan:
+        return {}, ""
+    return await asyncio.to_thread(_analyze_explain, explain_plan, dialect)
+
+def _analysis_response(dialect: str, parse_result: Dict[str, Any], issues: List[Issue], complexity_data: Dict[str, Any], explain: Tuple[Dict[str, Any], str]) -> Dict[str, Any]:
+    explain_analysis, explain_visualization = explain
+    return {
         "dialect": dialect,
         "query_structure": parse_result["metadata"],
         "complexity": complexity_data,
-        "issues": issues,
+        "issues": [issue.to_dict() for issue in issues],
         "explain_analysis": explain_analysis,
         "explain_visualization": explain_visualization,
         "summary": f"Found {len(issues)} potential performance issues. Complexity Score: {complexity_data['score']}/10"
     }
-    
-    return format_json_response(response)
 
-@mcp.tool()
-def optimize_query(sql: str, dialect: str = "postgres") -> str:
-    """
-    Rewrites a SQL query to be more optimized.
-    
-    Args:
-        sql: The SQL query to optimize.
-        dialect: The SQL dialect.
-    """
-    # Rewrite
-    optimized_sql = rewriter.rewrite(sql, dialect)
+def _optimization_response(sql: str, dialect: str) -> Dict[str, Any]:
+    # Rewrite (the ASTs are reused for cost estimation below)
+    optimized_sql, orig_ast, opt_ast = rewriter.rewrite_with_ast(sql, dialect)
     
     # Compare
-    improvements = rewriter.get_improvements(sql, optimized_sql)
+    improvements = rewriter.get_improvements(orig_ast, opt_ast) if orig_ast is not None and opt_ast is not None else []
     
     # Alternatives
-    alternatives = rewriter.generate_alternatives(sql, dialect)
+    alternatives = rewriter.generate_alternatives(sql, dialect, parsed=orig_ast)
     
     # Cost Estimation
-    # We need to parse both to get complexity
-    try:
-        orig_ast = parser.parse(sql, dialect)["ast"]
-        opt_ast = parser.parse(optimized_sql, dialect)["ast"]
+    if orig_ast is None or opt_ast is None:
+        cost_reduction = "Could not estimate cost reduction."
+    else:
         orig_score = analyzer.calculate_complexity_score(orig_ast)["score"]
         opt_score = analyzer.calculate_complexity_score(opt_ast)["score"]
         cost_reduction = rewriter.estimate_cost_reduction(orig_score, opt_score)
-    except:
-        cost_reduction = "Could not estimate cost reduction."
 
-    response = {
+    return {
         "original_sql": sql,
         "optimized_sql": optimized_sql,
         "alternatives": alternatives,
@@ -99,30 +80,131 @@ def optimize_query(sql: str, dialect: str = "postgres") -> str:
         "cost_reduction": cost_reduction,
         "comparison": create_table_comparison(sql, optimized_sql)
     }
+
+def _index_response(sql: str, dialect: str, ast: Optional[Any] = None) -> Dict[str, Any]:
+    suggestions = indexer.suggest_indexes(sql, dialect, ast=ast)
+    return {
+        "dialect": dialect,
+        "index_suggestions": [s.to_dict() for s in suggestions],
+        "count": len(suggestions)
+    }
+
+@mcp.tool(structured_output=False)
+async def analyze_query(sql: str, dialect: str = "auto", schema: Optional[str] = None, explain_plan: Optional[str] = None) -> List[TextContent]:
+    """
+    Analyzes a SQL query for performance issues and inefficiencies.
+    
+    Args:
+        sql: The SQL query to analyze.
+        dialect: The SQL dialect (postgresql, mysql, oracle, sqlserver, auto).
+        schema: Optional schema definition (not fully used in this version).
+        explain_plan: Optional text output from an EXPLAIN command.
+    """
+    # The CPU-bound stages run in worker threads so the event loop stays free
+    # to serve other requests; the query analysis and the explain plan analysis
+    # are independent and run concurrently.
+    if dialect == "auto":
+        dialect = detect_dialect(sql)
+
+    # Parse
+    parse_result = await asyncio.to_thread(parser.parse, sql, dialect)
+    if "error" in parse_result:
+        return _respond({"error": parse_result["error"]})
+
+    ast = parse_result["ast"]
+    
+    # Analyze, alongside the Explain Plan Analysis
+    (issues, complexity_data), explain = await asyncio.gather(
+        asyncio.to_thread(_analyze_ast, ast, sql),
+        _explain(explain_plan, dialect)
+    )
+
+    return _respond(_analysis_response(dialect, parse_result, issues, complexity_data, explain))
+
+@mcp.tool(structured_output=False)
+def optimize_query(sql: str, dialect: str = "postgres") -> List[TextContent]:
+    """
+    Rewrites a SQL query to be more optimized.
     
-    return format_json_response(response)
+    Args:
+        sql: The SQL query to optimize.
+        dialect: The SQL dialect.
+    """
+    return _respond(_optimization_response(sql, dialect))
 
-@mcp.tool()
-def suggest_indexes(sql: str, schema: Optional[str] = None) -> str:
+@mcp.tool(structured_output=False)
+def suggest_indexes(sql: str, schema: Optional[str] = None, dialect: str = "auto") -> List[TextContent]:
     """
     Suggests indexes based on the query's WHERE, JOIN, and GROUP BY clauses.
     
     Args:
         sql: The SQL query.
         schema: Optional schema context.
+        dialect: The SQL dialect (postgresql, mysql, oracle, sqlserver, auto).
     """
-    dialect = detect_dialect(sql)
-    suggestions = indexer.suggest_indexes(sql, dialect)
+    if dialect == "auto":
+        dialect = detect_dialect(sql)
+    return _respond(_index_response(sql, dialect))
+
+@mcp.tool(structured_output=False)
+async def analyze_and_optimize(sql: str, dialect: str = "auto", explain_plan: Optional[str] = None) -> List[TextContent]:
+    """
+    Analyzes, optimizes and suggests indexes for a SQL query in one call.
+    The dialect is detected and the query parsed once; the AST is shared by
+    all three stages. Same results as calling analyze_query, optimize_query
+    and suggest_indexes separately with the same dialect; note that with
+    dialect="auto" the optimization uses the detected dialect, whereas
+    optimize_query defaults to postgres.
     
+    Args:
+        sql: The SQL query.
+        dialect: The SQL dialect (postgresql, mysql, oracle, sqlserver, auto).
+        explain_plan: Optional text output from an EXPLAIN command.
+    """
+    if dialect == "auto":
+        dialect = detect_dialect(sql)
+
+    parse_result = await asyncio.to_thread(parser.parse, sql, dialect)
+    if "error" in parse_result:
+        return _respond({"error": parse_result["error"]})
+
+    ast = parse_result["ast"]
+    (issues, complexity_data), explain, optimization, indexes = await asyncio.gather(
+        asyncio.to_thread(_analyze_ast, ast, sql),
+        _explain(explain_plan, dialect),
+        asyncio.to_thread(_optimization_response, sql, dialect),
+        asyncio.to_thread(_index_response, sql, dialect, ast)
+    )
+
     response = {
         "dialect": dialect,
-        "index_suggestions": suggestions,
-        "count": len(suggestions)
+        "analysis": _analysis_response(dialect, parse_result, issues, complexity_data, explain),
+        "optimization": optimization,
+        "indexes": indexes
     }
-    
-    return format_json_response(response)
 
-if __name__ == "__main__":
+    return _respond(response)
+
+# Dialects to preload at startup (those detect_dialect can return, plus sqlite).
+WARMUP_DIALECTS = ("postgres", "mysql", "oracle", "tsql", "sqlite")
+
+def warmup() -> None:
+    """
+    Pays sqlglot's process-wide one-time costs (dialect class loading,
+    tokenizer tries, optimizer imports) at startup instead of inside the first
+    tool call. The tokenizers, parsers and generators built here are private to
+    the calling thread; the asyncio.to_thread workers that serve analyze_query
+    build their own on first use.
+    """
+    for dialect in WARMUP_DIALECTS:
+        to_sql(parse_sql("SELECT 1", dialect), dialect)
+    rewriter.rewrite_with_ast("SELECT t.a FROM t WHERE t.b = 1")
+
+def main() -> None:
     import sys
+    warmup()
     print("Universal SQL Query Optimizer MCP Server running on stdio...", file=sys.stderr)
     mcp.run()
+
+if __name__ == "__main__":
+    main()
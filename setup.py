@@ -0,0 +1,33 @@
+"""
+Optional compiled build.
+
+The package is pure Python by default. Setting SQL_OPTIMIZER_MYPYC=1 compiles
+the AST-walking hot paths and the Python glue around sqlglot (parse
+caching, rewriting, response formatting) to C extensions with mypyc (requires mypy in the
+build environment):
+
+    pip install mypy
+    SQL_OPTIMIZER_MYPYC=1 pip install --no-build-isolation .
+
+Compiled modules shadow the .py sources they are built from, so removing the
+extensions falls back to the pure Python code.
+"""
+import os
+from setuptools import setup
+
+MYPYC_MODULES = [
+    # core/ and utils/ have no __init__.py; map paths to dotted module names.
+    "--explicit-package-bases",
+    "core/analyzer.py",
+    "core/indexer.py",
+    "core/rewriter.py",
+    "utils/sql_utils.py",
+    "utils/formatting.py",
+]
+
+ext_modules = []
+if os.environ.get("SQL_OPTIMIZER_MYPYC") == "1":
+    from mypyc.build import mypycify
+    ext_modules = mypycify(MYPYC_MODULES, opt_level="3")
+
+setup(ext_modules=ext_modules)
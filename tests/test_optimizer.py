@@ -1,4 +1,6 @@
 import unittest
+import asyncio
+import json
 import sys
 import os
 
@@ -7,9 +9,13 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from core.dialect_detector import detect_dialect
 from core.parser import QueryParser
-from core.analyzer import QueryAnalyzer
+from core.analyzer import QueryAnalyzer, DEFAULT_RULES
 from core.rewriter import QueryRewriter
 from core.indexer import IndexSuggester
+from core.batch import analyze_many
+from core.explain_parser import ExplainParser
+from utils.formatting import create_table_comparison, NO_CHANGES
+import server
 
 class TestSQLOptimizer(unittest.TestCase):
     def setUp(self):
@@ -22,6 +28,9 @@ class TestSQLOptimizer(unittest.TestCase):
         self.assertEqual(detect_dialect("SELECT * FROM table LIMIT 10"), "postgres")
         self.assertEqual(detect_dialect("SELECT * FROM table WHERE ROWNUM < 10"), "oracle")
         self.assertEqual(detect_dialect("SELECT TOP 10 * FROM table"), "tsql")
+        self.assertEqual(detect_dialect("select top 10 * from table"), "tsql")
+        self.assertEqual(detect_dialect("SELECT `id` FROM `users` WHERE NVL(a, 0) = 1"), "oracle")
+        self.assertEqual(detect_dialect("SELECT `id` FROM `users` LIMIT 5"), "mysql")
 
     def test_parser(self):
         sql = "SELECT id, name FROM users WHERE age > 21"
@@ -29,18 +38,28 @@ class TestSQLOptimizer(unittest.TestCase):
         self.assertNotIn("error", result)
         self.assertEqual(result["metadata"]["tables"], ["users"])
         self.assertEqual(result["metadata"]["columns"], ["id", "name", "age"])
+        self.assertNotIn("sql_normalized", result)
+        self.assertEqual(self.parser.parse(sql, normalize=True)["sql_normalized"], sql)
+        self.assertEqual(self.parser.parse("SELECT id FROM users WHERE id > 1")["metadata"]["columns"], ["id"])
 
     def test_analyzer_select_star(self):
         sql = "SELECT * FROM users"
         ast = self.parser.parse(sql)["ast"]
         issues = self.analyzer.analyze(ast)
-        self.assertTrue(any(i["code"] == "SELECT_STAR" for i in issues))
+        self.assertTrue(any(i.code == "SELECT_STAR" for i in issues))
 
     def test_analyzer_missing_where(self):
         sql = "SELECT name FROM users"
         ast = self.parser.parse(sql)["ast"]
         issues = self.analyzer.analyze(ast)
-        self.assertTrue(any(i["code"] == "MISSING_WHERE" for i in issues))
+        self.assertTrue(any(i.code == "MISSING_WHERE" for i in issues))
+
+    def test_analyzer_custom_rules(self):
+        ast = self.parser.parse("SELECT * FROM users")["ast"]
+        rules = [r for r in DEFAULT_RULES if r.code != "SELECT_STAR"]
+        codes = [i.code for i in QueryAnalyzer(rules).analyze(ast)]
+        self.assertNotIn("SELECT_STAR", codes)
+        self.assertIn("MISSING_WHERE", codes)
 
     def test_rewriter(self):
         # Test simple optimization (e.g. 1=1 removal or just ensuring it runs)
@@ -50,12 +69,113 @@ class TestSQLOptimizer(unittest.TestCase):
         self.assertIn("SELECT", optimized)
         # Note: exact output depends on sqlglot version, but it should be valid SQL
 
+    def test_rewriter_fast_path(self):
+        # Plain queries are returned as is, anything else still goes through the optimizer
+        sql = "SELECT name FROM users ORDER BY name LIMIT 10"
+        self.assertEqual(self.rewriter.rewrite(sql), sql)
+        self.assertEqual(self.rewriter.generate_alternatives(sql), [])
+        case = self.rewriter.rewrite("SELECT CASE WHEN TRUE THEN t.a ELSE t.b END FROM t")
+        self.assertNotIn("CASE", case)
+        self.assertIn('"t"."a"', case)
+        self.assertIn('"t"."a" + 2', self.rewriter.rewrite("SELECT t.a + 1 + 1 FROM t"))
+        self.assertIn("CROSS JOIN", self.rewriter.rewrite("SELECT t.a FROM t, u"))
+        self.assertEqual(len(self.rewriter.generate_alternatives("SELECT t.a FROM t, u")), 1)
+
+    def test_rewriter_schema(self):
+        sql = "SELECT * FROM users WHERE id = 1"
+        optimized = self.rewriter.rewrite(sql, schema={"users": ["id", "name"]})
+        self.assertIn('"users"."name"', optimized)
+        # Unsupported schema shapes are ignored rather than failing the rewrite
+        self.assertEqual(self.rewriter.rewrite(sql, schema={"users": "id"}), sql)
+        self.assertEqual(self.rewriter.rewrite(sql, schema={"users": [1, 2]}), sql)
+        self.assertEqual(self.rewriter.rewrite(sql, schema={"users": [["a"]]}), sql)
+        # sqlglot's own {table: {column: type}} shape is passed through
+        typed = self.rewriter.rewrite(sql, schema={"users": {"id": "INT", "name": "TEXT"}})
+        self.assertIn('"users"."name"', typed)
+
+    def test_rewriter_improvements(self):
+        def improvements(sql):
+            _, orig_ast, opt_ast = self.rewriter.rewrite_with_ast(sql)
+            return self.rewriter.get_improvements(orig_ast, opt_ast)
+
+        tautology = "Removed tautologies (1=1) to simplify predicate evaluation."
+        to_join = "Converted correlated subqueries to JOINs (improves execution plan)."
+        pushdown = "Applied predicate pushdown and join optimization rules."
+        self.assertIn(tautology, improvements("SELECT t.a FROM t WHERE 1=1 AND t.b = 2"))
+        self.assertIn(to_join, improvements("SELECT t.a FROM t WHERE t.id IN (SELECT u.t_id FROM u)"))
+        # The original already joins, whatever the keyword's case
+        lower_join = improvements("select t.a from t join u on t.id = u.t_id where u.b = 1")
+        self.assertNotIn(to_join, lower_join)
+        self.assertIn(pushdown, lower_join)
+        # Nothing rewritten: the optimized AST is the original one
+        _, orig_ast, opt_ast = self.rewriter.rewrite_with_ast("SELECT name FROM users")
+        self.assertIs(opt_ast, orig_ast)
+        self.assertEqual(self.rewriter.get_improvements(orig_ast, opt_ast), [])
+
+    def test_table_comparison(self):
+        sql = "SELECT a FROM t"
+        self.assertEqual(create_table_comparison(sql, sql), NO_CHANGES)
+        diff = create_table_comparison(sql, "SELECT t.a\nFROM t")
+        self.assertIn("-SELECT a FROM t", diff)
+        self.assertIn("+SELECT t.a", diff)
+        self.assertEqual(
+            create_table_comparison(sql, sql, full=True),
+            f"Original:\n{sql}\n\nOptimized:\n{sql}"
+        )
+
     def test_indexer(self):
         sql = "SELECT * FROM users WHERE email = 'test@example.com'"
         suggestions = self.indexer.suggest_indexes(sql)
         self.assertTrue(len(suggestions) > 0)
-        self.assertEqual(suggestions[0]["table"], "users")
-        self.assertEqual(suggestions[0]["columns"], ["email"])
+        self.assertEqual(suggestions[0].table, "users")
+        self.assertEqual(suggestions[0].columns, ("email",))
+
+    def test_parse_cache_shared_with_indexer(self):
+        sql = "SELECT id FROM users WHERE email = 'a@b.c'"
+        ast = self.parser.parse(sql)["ast"]
+        self.assertIs(self.parser.parse(sql)["ast"], ast)
+        self.assertEqual(
+            self.indexer.suggest_indexes(sql, ast=ast),
+            self.indexer.suggest_indexes(sql)
+        )
+
+    def test_explain_parser_postgres(self):
+        plan = (
+            "Hash Join  (cost=1.00..20.50 rows=5 width=8) (actual time=0.1..0.4 rows=7 loops=1)\n"
+            "  ->  Seq Scan on orders  (cost=0.00..10.00 rows=100 width=4)\n"
+            "  ->  Index Scan using users_pkey on users  (cost=0.15..0.20 rows=1 width=4)"
+        )
+        result = ExplainParser().parse(plan)
+        self.assertEqual(result["total_cost"], 20.5)
+        self.assertEqual(result["estimated_rows"], 5)
+        self.assertEqual(result["actual_rows"], 7)
+        self.assertEqual([s["type"] for s in result["scans"]], ["Seq Scan", "Index Scan"])
+
+    def test_analyze_many(self):
+        queries = [
+            "SELECT * FROM users",
+            "SELECT id FROM users WHERE email = 'a@b.c'",
+            "SELECT a FROM t WHERE (a = 1",
+        ]
+        serial = analyze_many(queries, max_workers=1)
+        parallel = analyze_many(queries, max_workers=2, chunksize=1)
+        self.assertEqual(serial, parallel)
+        self.assertEqual([r["sql"] for r in parallel], queries)
+        self.assertTrue(any(i["code"] == "SELECT_STAR" for i in parallel[0]["issues"]))
+        self.assertEqual(parallel[1]["index_suggestions"][0]["columns"], ["email"])
+        self.assertIn("error", parallel[2])
+
+    def test_analyze_and_optimize(self):
+        def result(content):
+            return json.loads(content[0].text)
+
+        sql = "SELECT `id` FROM `users` WHERE status = 'active' OR 1=1 LIMIT 5"
+        dialect = detect_dialect(sql)
+        combined = result(asyncio.run(server.analyze_and_optimize(sql)))
+        self.assertEqual(combined["dialect"], dialect)
+        self.assertEqual(combined["analysis"], result(asyncio.run(server.analyze_query(sql))))
+        self.assertEqual(combined["optimization"], result(server.optimize_query(sql, dialect)))
+        self.assertEqual(combined["indexes"], result(server.suggest_indexes(sql)))
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,15 +1,37 @@
-import json
+import difflib
+import orjson
+from sqlglot import exp
 from typing import Any, Dict, List
 
+_JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+
+def _json_default(obj: Any) -> Any:
+    # ASTs are rendered as SQL; str() on an expression would build its verbose repr.
+    if isinstance(obj, exp.Expression):
+        return obj.sql()
+    return str(obj)
+
 def format_json_response(data: Any) -> str:
     """Formats data as a pretty-printed JSON string."""
-    return json.dumps(data, indent=2, default=str)
+    return orjson.dumps(data, default=_json_default, option=_JSON_OPTIONS).decode()
 
 def format_sql_code(sql: str) -> str:
     """Formats SQL code for display (could use sqlglot to pretty print)."""
     # We will use sqlglot in the parser/rewriter, but this is a fallback or wrapper
     return sql.strip()
 
-def create_table_comparison(original: str, optimized: str) -> str:
-    """Creates a simple text comparison of original vs optimized SQL."""
-    return f"Original:\n{original}\n\nOptimized:\n{optimized}"
+NO_CHANGES = "No changes: the optimized query is identical to the original."
+
+def create_table_comparison(original: str, optimized: str, full: bool = False) -> str:
+    """
+    Creates a text comparison of original vs optimized SQL: a unified diff of
+    the changed lines (NO_CHANGES if there are none), or both queries in full
+    when full=True.
+    """
+    if full:
+        return f"Original:\n{original}\n\nOptimized:\n{optimized}"
+    diff = "\n".join(difflib.unified_diff(
+        original.splitlines(), optimized.splitlines(),
+        fromfile="original", tofile="optimized", lineterm="", n=2
+    ))
+    return diff or NO_CHANGES
@@ -1,13 +1,98 @@
+import threading
 import sqlglot
 from sqlglot import exp
+from sqlglot.dialects.dialect import Dialect
+from sqlglot.errors import ParseError, TokenError
+from sqlglot.generator import Generator
+from sqlglot.parser import Parser
+from sqlglot.tokens import Tokenizer
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple, cast
+
+@lru_cache(maxsize=None)
+def get_dialect(dialect: str) -> Dialect:
+    """Resolves a dialect name to its Dialect instance once."""
+    return Dialect.get_or_raise(dialect)
+
+# Tokenizers, parsers and generators keep per-call state, so they are reused
+# per thread rather than shared.
+_local = threading.local()
+
+def _components() -> Dict[Tuple[str, str, bool], object]:
+    cache = getattr(_local, "components", None)
+    if cache is None:
+        cache = _local.components = {}
+    return cache
+
+def get_parser(dialect: str) -> Tuple[Tokenizer, Parser]:
+    """Cached (tokenizer, parser) pair for the dialect, private to the calling thread."""
+    cache = _components()
+    key = ("parser", dialect, False)
+    pair = cache.get(key)
+    if pair is None:
+        d = get_dialect(dialect)
+        pair = cache[key] = (d.tokenizer(), d.parser())
+    return cast(Tuple[Tokenizer, Parser], pair)
+
+def get_generator(dialect: str, pretty: bool = False) -> Generator:
+    """Cached generator for the dialect, private to the calling thread."""
+    cache = _components()
+    key = ("generator", dialect, pretty)
+    generator = cache.get(key)
+    if generator is None:
+        generator = cache[key] = get_dialect(dialect).generator(pretty=pretty)
+    return cast(Generator, generator)
+
+def try_parse_one(sql: str, dialect: str = "postgres") -> Tuple[Optional[exp.Expression], Optional[str]]:
+    """
+    Parses SQL with the cached dialect components without raising on invalid
+    input. Returns (ast, None), or (None, error message) if the SQL does not
+    parse or the dialect is unknown; the message is the one sqlglot.parse_one
+    would raise.
+    """
+    try:
+        tokenizer, parser = get_parser(dialect)
+        result = parser.parse(tokenizer.tokenize(sql), sql)
+    except (ParseError, TokenError, ValueError) as e: # ValueError: unknown dialect
+        return None, str(e)
+    if not result or result[0] is None:
+        return None, f"No expression was parsed from '{sql}'"
+    if len(result) > 1:
+        return exp.Block(expressions=result), None
+    return cast(exp.Expression, result[0]), None
+
+def to_sql(expression: exp.Expression, dialect: str = "postgres", pretty: bool = False) -> str:
+    """Same as expression.sql(dialect=dialect, pretty=pretty), with a cached generator."""
+    return get_generator(dialect, pretty).generate(expression)
+
+@lru_cache(maxsize=1024)
+def try_parse_sql(sql: str, dialect: str = "postgres") -> Tuple[Optional[exp.Expression], Optional[str]]:
+    """
+    Parses SQL with sqlglot, memoized on (sql, dialect). Returns (ast, None),
+    or (None, error message) for invalid SQL, so callers that expect bad input
+    need no exception handling and repeated bad input is not parsed again.
+    The returned AST is shared between callers and must be treated as read-only;
+    copy it (expression.copy()) before transforming it.
+    """
+    return try_parse_one(sql, dialect)
+
+def parse_sql(sql: str, dialect: str = "postgres") -> exp.Expression:
+    """
+    Like try_parse_sql, but returns the AST directly and raises ParseError if
+    the SQL does not parse.
+    """
+    ast, error = try_parse_sql(sql, dialect)
+    if ast is None:
+        raise ParseError(str(error))
+    return ast
 
 def get_tables(expression: exp.Expression) -> list[str]:
-    """Extracts all table names from a sqlglot expression."""
-    return [t.name for t in expression.find_all(exp.Table)]
+    """Extracts the distinct table names from a sqlglot expression, in first-seen order."""
+    return list(dict.fromkeys(t.name for t in expression.find_all(exp.Table)))
 
 def get_columns(expression: exp.Expression) -> list[str]:
-    """Extracts all column names from a sqlglot expression."""
-    return [c.name for c in expression.find_all(exp.Column)]
+    """Extracts the distinct column names from a sqlglot expression, in first-seen order."""
+    return list(dict.fromkeys(c.name for c in expression.find_all(exp.Column)))
 
 def is_select_star(expression: exp.Expression) -> bool:
     """Checks if the query is a SELECT *."""
@@ -16,3 +101,21 @@ def is_select_star(expression: exp.Expression) -> bool:
             if isinstance(projection, exp.Star):
                 return True
     return False
+
+def scan(expression: exp.Expression) -> Dict[str, Any]:
+    """
+    get_tables, get_columns and is_select_star in a single walk over the AST.
+    Returns {"tables": [...], "columns": [...], "is_select_star": bool}; the
+    names are distinct, in first-seen order.
+    """
+    tables: Dict[str, None] = {}
+    columns: Dict[str, None] = {}
+    add_table, add_column = tables.setdefault, columns.setdefault
+    Table, Column = exp.Table, exp.Column
+    for node in expression.walk():
+        if isinstance(node, Column):
+            add_column(node.name)
+        elif isinstance(node, Table):
+            add_table(node.name)
+    # Only the top-level projections matter, no walk needed.
+    return {"tables": list(tables), "columns": list(columns), "is_select_star": is_select_star(expression)}